@@ -0,0 +1,115 @@
+#
+# This file is part of LUNA.
+#
+# Copyright (c) 2020 Great Scott Gadgets <info@greatscottgadgets.com>
+# SPDX-License-Identifier: BSD-3-Clause
+
+""" Configuration helpers for Intel's ALTPLL primitive. """
+
+import math
+import unittest
+
+
+# Cyclone 10 LP / Cyclone IV PLL limits, in Hz.
+PLL_PFD_MIN = 5e6
+PLL_PFD_MAX = 325e6
+PLL_VCO_MIN = 600e6
+PLL_VCO_MAX = 1300e6
+
+# Largest values supported by the PLL's pre-scale (N), feedback (M) and post-scale (C) counters.
+PLL_N_MAX   = 512
+PLL_M_MAX   = 512
+PLL_C_MAX   = 512
+
+
+def compute_config(f_in, targets=(100e6, 60e6, 30e6), tolerances=None):
+    """ Finds an ALTPLL configuration that generates each of the target frequencies from f_in.
+
+    Searches the PLL's integer pre-divider (N) and feedback multiplier (M) values, keeping the
+    phase-frequency detector and VCO within Cyclone 10 LP / Cyclone IV limits; and then picks
+    the nearest integer post-divider (C) for each output. Configurations that place any output
+    outside of its tolerance are rejected outright; the remainder minimize the total error.
+
+    Parameters:
+        f_in       -- The frequency of the PLL's input clock, in Hz.
+        targets    -- The desired output frequencies, in Hz.
+        tolerances -- If provided, the maximum relative error allowed on each output; or None
+                      for outputs that should only be as close as possible to their targets.
+
+    Returns a list of (multiply_by, divide_by) pairs; one for each target.
+    """
+
+    best_config = None
+    best_error  = None
+
+    for n in range(1, PLL_N_MAX + 1):
+        f_pfd = f_in / n
+
+        # Our PFD frequency only decreases with N; so once it's too low, we're done.
+        if f_pfd < PLL_PFD_MIN:
+            break
+        if f_pfd > PLL_PFD_MAX:
+            continue
+
+        # Only consider the multipliers that could place our VCO in range.
+        m_min = max(math.floor(PLL_VCO_MIN / f_pfd), 1)
+        m_max = min(math.ceil(PLL_VCO_MAX / f_pfd), PLL_M_MAX)
+
+        for m in range(m_min, m_max + 1):
+            f_vco = f_pfd * m
+            if not (PLL_VCO_MIN <= f_vco <= PLL_VCO_MAX):
+                continue
+
+            # Pick the nearest post-divider for each of our outputs...
+            dividers = [min(max(round(f_vco / f_target), 1), PLL_C_MAX) for f_target in targets]
+            errors   = [abs(f_vco / c - f_target) / f_target for c, f_target in zip(dividers, targets)]
+
+            # ... skip this VCO frequency entirely if any output is out of tolerance...
+            if tolerances and any((t is not None) and (e > t) for e, t in zip(errors, tolerances)):
+                continue
+
+            error = sum(errors)
+
+            # ... and otherwise keep the best result, preferring higher VCO frequencies, which have less jitter.
+            if (best_error is None) or (error < best_error) or ((error == best_error) and (f_vco > best_config[2])):
+                best_config = (m, n, f_vco, dividers)
+                best_error  = error
+
+    if best_config is None:
+        raise ValueError(f"No PLL configuration can generate the requested clocks from {f_in / 1e6} MHz "
+            "within tolerance")
+
+    # Convert our M/N/C values into the multiply/divide ratios ALTPLL expects.
+    m, n, _, dividers = best_config
+    ratios = []
+    for c in dividers:
+        common = math.gcd(m, n * c)
+        ratios.append((m // common, (n * c) // common))
+
+    return ratios
+
+
+class ComputeConfigTest(unittest.TestCase):
+
+    def test_default_clocks(self):
+        self.assertEqual(compute_config(50e6), [(2, 1), (6, 5), (3, 5)])
+
+    def test_low_frequency_input(self):
+        self.assertEqual(compute_config(12e6), [(25, 3), (5, 1), (5, 2)])
+
+    def test_toleranced_output(self):
+        # The least total error here leaves our 60 MHz output 2667 ppm off; but an exact one is reachable.
+        self.assertEqual(compute_config(6.4e6), [(47, 3), (47, 5), (47, 10)])
+        self.assertEqual(compute_config(6.4e6, tolerances=(None, 500e-6, None)), [(15, 1), (75, 8), (75, 16)])
+
+    def test_unreachable_tolerance(self):
+        with self.assertRaises(ValueError):
+            compute_config(5.01e6, tolerances=(None, 500e-6, None))
+
+    def test_unreachable_input(self):
+        with self.assertRaises(ValueError):
+            compute_config(1e6)
+
+
+if __name__ == "__main__":
+    unittest.main()
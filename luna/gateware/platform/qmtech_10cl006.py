@@ -7,11 +7,72 @@ from amaranth.build import *
 from amaranth_boards.resources import *
 from amaranth_boards.qmtech_10cl006 import QMTech10CL006Platform
 
+from luna.gateware.architecture.altpll import compute_config
 from luna.gateware.platform.core import LUNAPlatform
 
+
+# Maximum relative error allowed on our USB clock; per the high-speed data rate tolerance [USB2, 7.1.11].
+USB_CLOCK_TOLERANCE = 500e-6
+
+
 class QMTech10CL006DomainGenerator(Elaboratable):
-    def __init__(self, *, clock_frequencies=None, clock_signal_name=None):
-        pass
+    """ Clock domain generator for the QMTech 10CL006 board.
+
+    Derives our fast, usb and sync domains from the board's default clock, using a single ALTPLL.
+    """
+
+    DEFAULT_CLOCK_FREQUENCIES_MHZ = {
+        'fast': 100,
+        'usb':  60,
+        'sync': 30,
+    }
+
+    def __init__(self, *, clock_frequencies=None, clock_signal_name=None, clock_signal_frequency=None):
+        """
+        Parameters:
+            clock_frequencies      -- A dictionary mapping 'fast', 'usb', and 'sync' to the clock
+                                      frequencies for those domains, in MHz. Any domains not provided
+                                      default to 100, 60 and 30 MHz, respectively.
+            clock_signal_name      -- Ignored; accepted for compatibility with other domain generators.
+                                      The PLL is always driven from the platform's default clock.
+            clock_signal_frequency -- The frequency of the PLL's input clock, in Hz. If provided, must
+                                      match the platform's default clock frequency.
+        """
+
+        # Grab our default clock frequencies, and then override any with our caller-provided copies.
+        self.clock_frequencies = self.DEFAULT_CLOCK_FREQUENCIES_MHZ.copy()
+        if clock_frequencies:
+            self.clock_frequencies.update(clock_frequencies)
+
+        self.clock_frequency = clock_signal_frequency
+
+
+    def _pll_params(self, clock_frequency):
+        """ Builds the ALTPLL parameters that generate our clocks from the given input frequency. """
+
+        # Figure out how to generate each of our clocks; in the order they appear on the PLL's outputs.
+        # Our USB clock is also driven out to the PHY as its reference clock; so it must be within
+        # the USB data-rate tolerance [USB2, 7.1.11]. We can't cascade a second PLL to fix up an
+        # inexact ratio without losing the phase relationship between our domains.
+        targets = [self.clock_frequencies[domain] * 1e6 for domain in ('fast', 'usb', 'sync')]
+        ratios  = compute_config(clock_frequency, targets, tolerances=(None, USB_CLOCK_TOLERANCE, None))
+
+        pll_params = dict(
+            p_BANDWIDTH_TYPE         = "AUTO",
+            p_INCLK0_INPUT_FREQUENCY = round(1e12 / clock_frequency),
+            p_OPERATION_MODE         = "NORMAL",
+        )
+
+        for index, (multiply_by, divide_by) in enumerate(ratios):
+            pll_params.update({
+                f"p_CLK{index}_DIVIDE_BY":   divide_by,
+                f"p_CLK{index}_DUTY_CYCLE":  50,
+                f"p_CLK{index}_MULTIPLY_BY": multiply_by,
+                f"p_CLK{index}_PHASE_SHIFT": 0,
+            })
+
+        return pll_params
+
 
     def elaborate(self, platform):
         m = Module()
@@ -21,6 +82,12 @@ class QMTech10CL006DomainGenerator(Elaboratable):
         m.domains.sync = ClockDomain("sync")
         m.domains.fast = ClockDomain("fast")
 
+        # Our PLL is always driven from the platform's default clock; so its frequency is authoritative.
+        clock_frequency = platform.default_clk_frequency
+        if self.clock_frequency is not None:
+            assert self.clock_frequency == clock_frequency, \
+                f"clock_signal_frequency ({self.clock_frequency}) must match the default clock ({clock_frequency})"
+
         clk = platform.request(platform.default_clk)
 
         sys_clocks   = Signal(3)
@@ -29,28 +96,10 @@ class QMTech10CL006DomainGenerator(Elaboratable):
         reset       = Signal()
 
         m.submodules.mainpll = Instance("ALTPLL",
-            p_BANDWIDTH_TYPE         = "AUTO",
-            # 100MHz
-            p_CLK0_DIVIDE_BY         = 1,
-            p_CLK0_DUTY_CYCLE        = 50,
-            p_CLK0_MULTIPLY_BY       = 2,
-            p_CLK0_PHASE_SHIFT       = 0,
-            # 60MHz
-            p_CLK1_DIVIDE_BY         = 5,
-            p_CLK1_DUTY_CYCLE        = 50,
-            p_CLK1_MULTIPLY_BY       = 6,
-            p_CLK1_PHASE_SHIFT       = 0,
-            # 30MHz
-            p_CLK2_DIVIDE_BY         = 10,
-            p_CLK2_DUTY_CYCLE        = 50,
-            p_CLK2_MULTIPLY_BY       = 6,
-            p_CLK2_PHASE_SHIFT       = 0,
-
-            p_INCLK0_INPUT_FREQUENCY = 20000,
-            p_OPERATION_MODE         = "NORMAL",
+            **self._pll_params(clock_frequency),
 
-            # Drive our clock from the USB clock
-            # coming from the USB clock pin of the USB3300
+            # Drive our clocks from the board's default clock; our USB clock
+            # is then driven out to the USB3300 as its reference clock.
             i_inclk  = clk,
             o_clk    = sys_clocks,
             o_locked = sys_locked,
@@ -84,10 +133,18 @@ class QMTech10CL006USBPlatform(QMTech10CL006Platform, LUNAPlatform):
             set_global_assignment -name PHYSICAL_SYNTHESIS_EFFORT "Extra"
             set_instance_assignment -name DECREASE_INPUT_DELAY_TO_INPUT_REGISTER OFF -to *ulpi*
             set_instance_assignment -name INCREASE_DELAY_TO_OUTPUT_PIN OFF -to *ulpi*
+            set_instance_assignment -name FAST_INPUT_REGISTER ON -to *ulpi*data*
+            set_instance_assignment -name FAST_INPUT_REGISTER ON -to *ulpi*nxt*
+            set_instance_assignment -name FAST_INPUT_REGISTER ON -to *ulpi*dir*
+            set_instance_assignment -name FAST_OUTPUT_REGISTER ON -to *ulpi*data*
+            set_instance_assignment -name FAST_OUTPUT_REGISTER ON -to *ulpi*stp*
             set_global_assignment -name NUM_PARALLEL_PROCESSORS ALL
         """
+        # Our input clock is already constrained by the platform's own SDC template, via its
+        # resource's Clock() constraint; so we only need to add our PLL outputs and their uncertainty.
         templates["{{name}}.sdc"] += r"""
             derive_pll_clocks
+            derive_clock_uncertainty
             """
         return templates
 
@@ -104,4 +161,5 @@ class QMTech10CL006USBPlatform(QMTech10CL006Platform, LUNAPlatform):
                 Attrs(io_standard="3.3-V LVCMOS")),
         ]
 
-    super().__init__(standalone=False)
\ No newline at end of file
+        super().__init__(standalone=False)
+
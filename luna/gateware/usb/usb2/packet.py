@@ -1150,6 +1150,8 @@ class USBDataPacketDeserializer(Elaboratable):
 
     packet: Signal(max_packet_size), output
         Packet data for a the most recently received packet.
+    packet_word: Signal(max_packet_size * 8), output
+        The same packet data as ``packet``, presented as a single little-endian word.
     length: Signal(range(0, max_packet_length +1)), output
         The length of the packet data presented on the packet[] output.
 
@@ -1180,6 +1182,7 @@ class USBDataPacketDeserializer(Elaboratable):
 
         self.packet_id   = Signal(4)
         self.packet      = Array(Signal(8, name=f"packet_{i}") for i in range(max_packet_size))
+        self.packet_word = Signal(max_packet_size * 8)
         self.length      = Signal(range(0, max_packet_size + 1))
 
 
@@ -1218,6 +1221,9 @@ class USBDataPacketDeserializer(Elaboratable):
         m.d.usb += self.new_packet      .eq(0)
         m.d.comb += self.data_crc.start  .eq(0)
 
+        # Provide a flat view of our packet data.
+        m.d.comb += self.packet_word.eq(Cat(*self.packet))
+
         with m.FSM(domain="usb"):
 
             # IDLE -- waiting for a packet to be presented
@@ -1319,6 +1325,7 @@ class USBDataPacketDeserializerTest(USBPacketizerTest):
         self.assertEqual((yield self.dut.packet[1]),  0b01000101)
         self.assertEqual((yield self.dut.packet[2]),  0b01100111)
         self.assertEqual((yield self.dut.packet[3]),  0b10001001)
+        self.assertEqual((yield self.dut.packet_word[0:32]), 0b10001001_01100111_01000101_00100011)
 
 
     @usb_domain_test_case
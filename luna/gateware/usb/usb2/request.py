@@ -7,11 +7,10 @@
 """ Low-level USB transciever gateware -- control request components. """
 
 import unittest
-import functools
-import operator
 
-from amaranth            import Signal, Module, Elaboratable, Cat
-from amaranth.hdl.rec    import Record, DIR_FANOUT
+from amaranth            import Signal, Module, Elaboratable, Cat, Array, ClockDomain
+from amaranth.lib.coding import PriorityEncoder
+from amaranth.hdl.rec    import Record, DIR_FANIN, DIR_FANOUT
 
 from .                   import USBSpeed
 from .packet             import USBTokenDetector, USBDataPacketDeserializer, USBPacketizerTest
@@ -21,11 +20,33 @@ from ..stream            import USBInStreamInterface, USBOutStreamInterface
 from ..request           import SetupPacket
 from ...utils.bus        import OneHotMultiplexer
 
-from ...test             import usb_domain_test_case
+from ...test             import LunaUSBGatewareTestCase, usb_domain_test_case
 
 
 
-class RequestHandlerInterface:
+# Single-signal components of a RequestHandlerInterface; see its documentation for details.
+# Directions are relative to the control endpoint; so inputs to a request handler fan out to it,
+# and the handler's outputs fan back in.
+REQUEST_HANDLER_LAYOUT = [
+    ('data_requested',        1, DIR_FANOUT),
+    ('status_requested',      1, DIR_FANOUT),
+
+    ('address_changed',       1, DIR_FANIN),
+    ('new_address',           7, DIR_FANIN),
+
+    ('active_config',         8, DIR_FANOUT),
+    ('config_changed',        1, DIR_FANIN),
+    ('new_config',            8, DIR_FANIN),
+
+    ('rx_expected',           1, DIR_FANIN),
+    ('rx_ready_for_response', 1, DIR_FANOUT),
+    ('rx_invalid',            1, DIR_FANOUT),
+
+    ('tx_data_pid',           1, DIR_FANIN),
+]
+
+
+class RequestHandlerInterface(Record):
     """ Record representing a connection between a control endpoint and a request handler.
 
     Components (I = input to request handler; O = output to control interface):
@@ -50,6 +71,7 @@ class RequestHandlerInterface:
 
         # Data rx signals.
         *: rx                     -- The receive stream for any data packets received.
+        O: rx_expected            -- Reserved; not currently used by the control endpoint.
         I: handshakes_in          -- Inputs that indicate when handshakes are detected from the host.
         I: rx_ready_for_response  -- Strobe that indicates that we're ready to respond to a complete transmission.
                                      Indicates that an interpacket delay has passed after an `rx_complete` strobe.
@@ -59,31 +81,25 @@ class RequestHandlerInterface:
         # Data tx signals.
         *: tx                     -- The transmit stream for any packets generated by the handler.
         O: handshakes_out         -- Carries handshake generation requests.
+        O: tx_data_pid            -- The data PID (DATA0 or DATA1) to use for the packet being transmitted.
+
+    The single-signal components are fields of this record; the composite interfaces
+    (setup, tokenizer, rx, tx, and handshakes) are carried alongside it as attributes.
     """
 
     def __init__(self):
+        super().__init__(REQUEST_HANDLER_LAYOUT, fields={
+            # Our transmit PID starts as DATA1, which is always used for the first data-phase packet.
+            'tx_data_pid': Signal(reset=1, name="tx_data_pid"),
+        })
+
         self.setup                 = SetupPacket()
         self.tokenizer             = TokenDetectorInterface()
 
-        self.data_requested        = Signal()
-        self.status_requested      = Signal()
-
-        self.address_changed       = Signal()
-        self.new_address           = Signal(7)
-
-        self.active_config         = Signal(8)
-        self.config_changed        = Signal()
-        self.new_config            = Signal(8)
-
         self.rx                    = USBOutStreamInterface()
-        self.rx_expected           = Signal()
-        self.rx_ready_for_response = Signal()
-        self.rx_invalid            = Signal()
-
         self.tx                    = USBInStreamInterface()
         self.handshakes_out        = HandshakeExchangeInterface(is_detector=True)
         self.handshakes_in         = HandshakeExchangeInterface(is_detector=False)
-        self.tx_data_pid           = Signal(reset=1)
 
 
 
@@ -133,17 +149,24 @@ class USBSetupDecoder(Elaboratable):
     """
     SETUP_PID = 0b1101
 
-    def __init__(self, *, utmi, standalone=False):
+    # Layout of the fields that follow bmRequestType in a setup packet [USB2, 9.3];
+    # as (field name, byte offset, length in bytes). Multi-byte fields are little endian.
+    _SETUP_FIELDS = [
+        ('request', 1, 1),
+        ('value',   2, 2),
+        ('index',   4, 2),
+        ('length',  6, 2),
+    ]
+
+    # If true, our data-packet deserializer will generate its own data CRCs.
+    _CREATE_CRC_GENERATOR = False
+
+    def __init__(self, *, utmi):
         """
         Paremeters:
             utmi           -- The UTMI bus we'll monitor for data. We'll consider this read-only.
-
-            standalone     -- Debug parameter. If true, this module will operate without external components;
-                              i.e. without an internal data-CRC generator, or tokenizer. In this case, tokenizer
-                              and timer should be set to None; and will be ignored.
         """
         self.utmi          = utmi
-        self.standalone    = standalone
 
         #
         # I/O port.
@@ -157,49 +180,63 @@ class USBSetupDecoder(Elaboratable):
         self.packet        = SetupPacket()
         self.ack           = Signal()
 
+        #
+        # Internals.
+        #
 
-    def elaborate(self, platform):
-        m = Module()
-
-        # If we're standalone, generate the things we need.
-        if self.standalone:
-
-            # Create our tokenizer...
-            m.submodules.tokenizer = tokenizer = USBTokenDetector(utmi=self.utmi)
-            m.d.comb += tokenizer.interface.connect(self.tokenizer)
-
-            # ... and our timer.
-            m.submodules.timer = timer = USBInterpacketTimer()
-            timer.add_interface(self.timer)
+        # The signals that make up our bmRequestType [USB2, 9.3]; these depend only on
+        # our setup packet, so we only need to collect them once.
+        self._request_type = Cat(self.packet.recipient, self.packet.type, self.packet.is_in_request)
 
-            m.d.comb += timer.speed.eq(self.speed)
 
+    def elaborate(self, platform):
+        m = Module()
 
         # Create a data-packet-deserializer, which we'll use to capture the
         # contents of the setup data packets.
         m.submodules.data_handler = data_handler = \
-            USBDataPacketDeserializer(utmi=self.utmi, max_packet_size=8, create_crc_generator=self.standalone)
+            USBDataPacketDeserializer(utmi=self.utmi, max_packet_size=8, create_crc_generator=self._CREATE_CRC_GENERATOR)
         m.d.comb += self.data_crc.connect(data_handler.data_crc)
 
-        # Instruct our interpacket timer to begin counting when we complete receiving
-        # our setup packet. This will allow us to track interpacket delays.
-        m.d.comb += self.timer.start.eq(data_handler.new_packet)
-
         # Keep our output signals de-asserted unless specified.
+        #
+        # Note that `received` is deliberately registered: the setup fields are latched
+        # on the same edge, so a registered strobe is the only way to ensure that consumers
+        # never see `received` alongside the previous packet's fields.
         m.d.usb += [
             self.packet.received  .eq(0),
         ]
 
 
-        with m.FSM(domain="usb"):
+        # Strobe that indicates we've just received a new SETUP token addressed to us.
+        setup_token = Signal()
+        m.d.comb += setup_token.eq((self.tokenizer.pid == self.SETUP_PID) & self.tokenizer.new_token)
+
+        # Gather the events we respond to while reading setup data, so we can handle them in a single switch:
+        # bit 0 is a new token; bit 1 is a new, correctly-sized setup packet; and bit 2 is any new packet.
+        read_data_events = Cat(
+            self.tokenizer.new_token,
+            data_handler.new_packet & (data_handler.length == 8),
+            data_handler.new_packet,
+        )
+
+        # Figure out how to parse the setup data itself.
+        raw = data_handler.packet_word
+        parse_setup_data = [self._request_type.eq(raw[0:8])]
+        parse_setup_data.extend(
+            getattr(self.packet, name).eq(raw[offset * 8:(offset + length) * 8])
+                for name, offset, length in self._SETUP_FIELDS
+        )
+
+
+        with m.FSM(domain="usb") as fsm:
 
             # IDLE -- we haven't yet detected a SETUP transaction directed at us
             with m.State('IDLE'):
-                pid_matches     = (self.tokenizer.pid     == self.SETUP_PID)
 
                 # If we're just received a new SETUP token addressed to us,
                 # the next data packet is going to be for us.
-                with m.If(pid_matches & self.tokenizer.new_token):
+                with m.If(setup_token):
                     m.next = 'READ_DATA'
 
 
@@ -207,33 +244,16 @@ class USBSetupDecoder(Elaboratable):
             # data payload of the transaction, which contains the setup packet.
             with m.State('READ_DATA'):
 
-                # If we receive a token packet before we receive a DATA packet,
-                # this is a PID mismatch. Bail out and start over.
-                with m.If(self.tokenizer.new_token):
-                    m.next = 'IDLE'
-
-                # If we have a new packet, parse it as setup data.
-                with m.If(data_handler.new_packet):
+                with m.Switch(read_data_events):
 
-                    # If we got exactly eight bytes, this is a valid setup packet.
-                    with m.If(data_handler.length == 8):
+                    # If we got a new packet of exactly eight bytes, this is a valid setup packet.
+                    with m.Case("-1-"):
 
-                        # Collect the signals that make up our bmRequestType [USB2, 9.3].
-                        request_type = Cat(self.packet.recipient, self.packet.type, self.packet.is_in_request)
+                        # Parse the setup data itself...
+                        m.d.usb += parse_setup_data
 
-                        m.d.usb += [
-
-                            # Parse the setup data itself...
-                            request_type            .eq(data_handler.packet[0]),
-                            self.packet.request     .eq(data_handler.packet[1]),
-                            self.packet.value       .eq(Cat(data_handler.packet[2], data_handler.packet[3])),
-                            self.packet.index       .eq(Cat(data_handler.packet[4], data_handler.packet[5])),
-                            self.packet.length      .eq(Cat(data_handler.packet[6], data_handler.packet[7])),
-
-                            # ... and indicate that we have new data.
-                            self.packet.received  .eq(1),
-
-                        ]
+                        # ... and indicate that we have new data.
+                        m.d.usb += self.packet.received.eq(1)
 
                         # We'll now need to wait a receive-transmit delay before initiating our ACK.
                         # Per the USB 2.0 and ULPI 1.1 specifications:
@@ -252,9 +272,10 @@ class USBSetupDecoder(Elaboratable):
                         with m.Else():
                             m.next = "INTERPACKET_DELAY"
 
-
-                    # Otherwise, this isn't; and we should ignore it. [USB2, 8.5.3]
-                    with m.Else():
+                    # If we got any other packet, it isn't a setup packet; and we should ignore it. [USB2, 8.5.3]
+                    # If we receive a token packet before we receive a DATA packet, this is a PID mismatch.
+                    # Either way, bail out and start over.
+                    with m.Case("1--", "--1"):
                         m.next = "IDLE"
 
 
@@ -266,12 +287,42 @@ class USBSetupDecoder(Elaboratable):
                     m.d.comb += self.ack.eq(1)
                     m.next = "IDLE"
 
+
+        # Instruct our interpacket timer to begin counting when we complete receiving
+        # our setup packet. This will allow us to track interpacket delays. We only care
+        # about data packets that follow a SETUP token; so we ignore any others.
+        m.d.comb += self.timer.start.eq(data_handler.new_packet & fsm.ongoing('READ_DATA'))
+
+        return m
+
+
+class StandaloneUSBSetupDecoder(USBSetupDecoder):
+    """ Debug variant of USBSetupDecoder that operates without external components.
+
+    Includes its own data-CRC generator, tokenizer, and interpacket timer; so the `data_crc`,
+    `tokenizer` and `timer` interfaces are driven internally, and can be left unconnected.
+    """
+
+    _CREATE_CRC_GENERATOR = True
+
+    def elaborate(self, platform):
+        m = super().elaborate(platform)
+
+        # Create our tokenizer...
+        m.submodules.tokenizer = tokenizer = USBTokenDetector(utmi=self.utmi)
+        m.d.comb += tokenizer.interface.connect(self.tokenizer)
+
+        # ... and our timer.
+        m.submodules.timer = timer = USBInterpacketTimer()
+        timer.add_interface(self.timer)
+
+        m.d.comb += timer.speed.eq(self.speed)
+
         return m
 
 
 class USBSetupDecoderTest(USBPacketizerTest):
-    FRAGMENT_UNDER_TEST = USBSetupDecoder
-    FRAGMENT_ARGUMENTS = {'standalone': True}
+    FRAGMENT_UNDER_TEST = StandaloneUSBSetupDecoder
 
 
     def initialize_signals(self):
@@ -280,25 +331,32 @@ class USBSetupDecoderTest(USBPacketizerTest):
         yield self.dut.speed.eq(USBSpeed.HIGH)
 
 
+    # Our reference SETUP token...
+    _SETUP_TOKEN = bytes([
+        0b00101101,            # PID: SETUP token.
+        0b00000000, 0b00010000 # Address 0, endpoint 0, CRC
+    ])
+
+    # ... and the data packet that accompanies it.
+    _SETUP_DATA = bytes([
+        0b11000011,   # PID: DATA0
+        0b0_10_00010, # out vendor request to endpoint
+        12,           # request number 12
+        0xcd, 0xab,   # value  0xABCD (little endian)
+        0x23, 0x01,   # index  0x0123
+        0x78, 0x56,   # length 0x5678
+        0x3b, 0xa2,   # CRC
+    ])
+
+
     def provide_reference_setup_transaction(self):
         """ Provide a reference SETUP transaction. """
 
-        # Provide our setup packet.
-        yield from self.provide_packet(
-            0b00101101, # PID: SETUP token.
-            0b00000000, 0b00010000 # Address 0, endpoint 0, CRC
-        )
+        # Provide our setup packet...
+        yield from self.provide_packet(*self._SETUP_TOKEN)
 
-        # Provide our data packet.
-        yield from self.provide_packet(
-            0b11000011,   # PID: DATA0
-            0b0_10_00010, # out vendor request to endpoint
-            12,           # request number 12
-            0xcd, 0xab,   # value  0xABCD (little endian)
-            0x23, 0x01,   # index  0x0123
-            0x78, 0x56,   # length 0x5678
-            0x3b, 0xa2,   # CRC
-        )
+        # ... and our data packet.
+        yield from self.provide_packet(*self._SETUP_DATA)
 
 
     @usb_domain_test_case
@@ -359,10 +417,7 @@ class USBSetupDecoderTest(USBPacketizerTest):
         self.assertEqual((yield dut.packet.received), 0)
 
         # Provide our setup packet.
-        yield from self.provide_packet(
-            0b00101101, # PID: SETUP token.
-            0b00000000, 0b00010000 # Address 0, endpoint 0, CRC
-        )
+        yield from self.provide_packet(*self._SETUP_TOKEN)
 
         # Provide our data packet; but shorter than expected.
         yield from self.provide_packet(
@@ -376,6 +431,37 @@ class USBSetupDecoderTest(USBPacketizerTest):
         self.assertEqual((yield dut.packet.received), 0)
 
 
+class _TransmitSelectInterface:
+    """ Internal interface that pairs a transmit stream with the data PID it should be sent with.
+
+    Stream signals (e.g. `valid`, `payload`) can be accessed directly on this interface, which allows
+    it to be multiplexed by a OneHotMultiplexer.
+
+    Components:
+        *: tx          -- The transmit stream.
+        *: tx_data_pid -- The data PID to use for the packet on `tx`.
+    """
+
+    def __init__(self, *, tx=None, tx_data_pid=None):
+        """
+        Parameters:
+            tx          -- The transmit stream to wrap; or None to create a new one.
+            tx_data_pid -- The data PID signal to wrap; or None to create a new one.
+        """
+        self.tx          = tx          if (tx is not None)          else USBInStreamInterface()
+        self.tx_data_pid = tx_data_pid if (tx_data_pid is not None) else Signal()
+
+
+    def __getattr__(self, name):
+        # Avoid recursing forever if our stream hasn't been set up yet.
+        if name == 'tx':
+            raise AttributeError(name)
+
+        # Allow our stream's signals to be accessed directly.
+        return getattr(self.tx, name)
+
+
+
 class USBRequestHandlerMultiplexer(Elaboratable):
     """ Multiplexes multiple RequestHandlers down to a single interface.
 
@@ -385,6 +471,16 @@ class USBRequestHandlerMultiplexer(Elaboratable):
         *: shared -- The post-multiplexer RequestHandler interface.
     """
 
+    # Groups of signals routed -from- our pre-mux interfaces; as (select signal, signals passed through
+    # while the select signal is high).
+    _MULTIPLEXED_SIGNALS = [
+        ('address_changed', ['address_changed', 'new_address']),
+        ('config_changed',  ['config_changed',  'new_config']),
+    ]
+
+    # Handshake requests; which are OR'd together from all of our pre-mux interfaces.
+    _HANDSHAKE_SIGNALS = ['ack', 'nak', 'stall']
+
     def __init__(self):
 
         #
@@ -407,9 +503,18 @@ class USBRequestHandlerMultiplexer(Elaboratable):
         self._interfaces.append(interface)
 
 
+    @staticmethod
+    def _or_tree(signals):
+        """ Returns an expression that's true iff any of the provided single-bit signals are high. """
+        return Cat(*signals).any()
+
+
     def _multiplex_signals(self, m, *, when, multiplex, sub_bus=None):
         """ Helper that creates a simple priority-encoder multiplexer.
 
+        When no interface's `when` signal is high, each of the `multiplex` signals on our
+        shared interface is held at zero.
+
         Parmeters:
             when      -- The name of the interface signal that indicates that the `multiplex` signals
                          should be selected for output. If this signals should be multiplex, it
@@ -427,27 +532,25 @@ class USBRequestHandlerMultiplexer(Elaboratable):
                 return  getattr(interface, name)
 
 
-        # We're building an if-elif tree; so we should start with an If entry.
-        conditional = m.If
-
-        for interface in self._interfaces:
-            condition = get_signal(interface, when)
-
-            with conditional(condition):
-
-                # Connect up each of our signals.
-                for signal_name in multiplex:
+        # Resolve each of the signals we'll need from our interfaces once, up front. Our `when`
+        # signal is usually also multiplexed; so this avoids fetching it twice.
+        interface_signals = {
+            name: [get_signal(interface, name) for interface in self._interfaces]
+                for name in (when, *multiplex)
+        }
 
-                    # Get the actual signals for our input and output...
-                    driving_signal = get_signal(interface,   signal_name)
-                    target_signal  = get_signal(self.shared, signal_name)
+        # Encode our interfaces' select signals into a single index, which is shared
+        # by each of the signals we're multiplexing.
+        m.submodules[f"{when}_encoder"] = encoder = PriorityEncoder(len(self._interfaces))
+        m.d.comb += encoder.i.eq(Cat(interface_signals[when]))
 
-                    # ... and connect them.
-                    m.d.comb += target_signal   .eq(driving_signal)
-
-            # After the first element, all other entries should be created with Elif.
-            conditional = m.Elif
+        # Select each of our multiplexed signals from the active interface; if any.
+        with m.If(~encoder.n):
+            for signal_name in multiplex:
+                driving_signals = Array(interface_signals[signal_name])
+                target_signal   = get_signal(self.shared, signal_name)
 
+                m.d.comb += target_signal.eq(driving_signals[encoder.o])
 
 
     def elaborate(self, platform):
@@ -473,48 +576,183 @@ class USBRequestHandlerMultiplexer(Elaboratable):
                 interface.rx_invalid             .eq(shared.rx_invalid),
             ]
 
+        # OR together all of our handshake-generation requests. We gather each handshake in a
+        # single pass, and then reduce each set with a single wide OR, rather than a chain of
+        # two-input ORs. With no interfaces, we'll never generate handshakes.
+        handshake_requests = {name: [] for name in self._HANDSHAKE_SIGNALS}
+        for i in self._interfaces:
+            for name in self._HANDSHAKE_SIGNALS:
+                handshake_requests[name].append(getattr(i.handshakes_out, name))
+
+        for name, requests in handshake_requests.items():
+            m.d.comb += getattr(shared.handshakes_out, name).eq(self._or_tree(requests))
+
+        # If we have no interfaces, there's nothing else to multiplex.
+        if not self._interfaces:
+            return m
+
         #
         # Multiplex the signals being routed -from- our pre-mux interface.
         #
-        self._multiplex_signals(m,
-            when='address_changed',
-            multiplex=['address_changed', 'new_address']
-        )
 
-        self._multiplex_signals(m,
-            when='config_changed',
-            multiplex=['config_changed', 'new_config']
-        )
+        # If we only have a single interface, we don't need to multiplex anything;
+        # and can connect it directly to our shared interface.
+        if len(self._interfaces) == 1:
+            interface = self._interfaces[0]
+
+            for when, multiplex in self._MULTIPLEXED_SIGNALS:
+                with m.If(getattr(interface, when)):
+                    m.d.comb += [getattr(shared, name).eq(getattr(interface, name)) for name in multiplex]
+
+            tx          = interface.tx
+            tx_data_pid = interface.tx_data_pid
+
+        else:
+            for when, multiplex in self._MULTIPLEXED_SIGNALS:
+                self._multiplex_signals(m, when=when, multiplex=multiplex)
+
+            # Multiplex our transmit interfaces; passing through the relevant PID from our
+            # data source alongside its data.
+            m.submodules.tx_mux = tx_mux = OneHotMultiplexer(
+                interface_type=_TransmitSelectInterface,
+                mux_signals=('payload', 'tx_data_pid'),
+                or_signals=('valid', 'first', 'last'),
+                pass_signals=('ready',)
+            )
+            tx_mux.add_interfaces(
+                _TransmitSelectInterface(tx=i.tx, tx_data_pid=i.tx_data_pid) for i in self._interfaces
+            )
+
+            tx          = tx_mux.output.tx
+            tx_data_pid = tx_mux.output.tx_data_pid
 
         # Connect up our transmit interface.
-        m.submodules.tx_mux = tx_mux = OneHotMultiplexer(
-            interface_type=USBInStreamInterface,
-            mux_signals=('payload',),
-            or_signals=('valid', 'first', 'last'),
-            pass_signals=('ready',)
-        )
-        tx_mux.add_interfaces(i.tx for i in self._interfaces)
-        m.d.comb += self.shared.tx.stream_eq(tx_mux.output)
+        m.d.comb += [
+            shared.tx           .stream_eq(tx),
+            shared.tx_data_pid  .eq(tx_data_pid),
+        ]
 
-        # Pass through the relevant PID from our data source.
-        for i in self._interfaces:
-            with m.If(i.tx.valid):
-                m.d.comb += self.shared.tx_data_pid.eq(i.tx_data_pid)
+        return m
 
-        # OR together all of our handshake-generation requests.
-        any_ack   = functools.reduce(operator.__or__, (i.handshakes_out.ack   for i in self._interfaces))
-        any_nak   = functools.reduce(operator.__or__, (i.handshakes_out.nak   for i in self._interfaces))
-        any_stall = functools.reduce(operator.__or__, (i.handshakes_out.stall for i in self._interfaces))
 
-        m.d.comb += [
-            shared.handshakes_out.ack    .eq(any_ack),
-            shared.handshakes_out.nak    .eq(any_nak),
-            shared.handshakes_out.stall  .eq(any_stall),
-        ]
+class USBRequestHandlerMultiplexerTest(LunaUSBGatewareTestCase):
+    HANDLER_COUNT = 3
+
+    def instantiate_dut(self):
+        m = Module()
+
+        # Our multiplexer is purely combinational; so provide a USB domain for our test to run in.
+        m.domains.usb = ClockDomain()
+
+        self.handlers = [RequestHandlerInterface() for _ in range(self.HANDLER_COUNT)]
+
+        m.submodules.mux = self.mux = USBRequestHandlerMultiplexer()
+        for handler in self.handlers:
+            self.mux.add_interface(handler)
 
         return m
 
 
+    @usb_domain_test_case
+    def test_handshake_passthrough(self):
+        shared = self.mux.shared.handshakes_out
+
+        # With no requests, we shouldn't generate any handshakes.
+        yield
+        self.assertEqual((yield shared.ack),   0)
+        self.assertEqual((yield shared.nak),   0)
+        self.assertEqual((yield shared.stall), 0)
+
+        # Each handler should be able to request each handshake.
+        for handler in self.handlers:
+            for name in ('ack', 'nak', 'stall'):
+                yield getattr(handler.handshakes_out, name).eq(1)
+                yield
+                self.assertEqual((yield getattr(shared, name)), 1)
+
+                yield getattr(handler.handshakes_out, name).eq(0)
+                yield
+                self.assertEqual((yield getattr(shared, name)), 0)
+
+
+    @usb_domain_test_case
+    def test_address_and_config_change(self):
+        shared = self.mux.shared
+
+        # With no changes requested, our shared outputs should be held at zero.
+        yield
+        self.assertEqual((yield shared.address_changed), 0)
+        self.assertEqual((yield shared.new_address),     0)
+        self.assertEqual((yield shared.config_changed),  0)
+        self.assertEqual((yield shared.new_config),      0)
+
+        for index, handler in enumerate(self.handlers):
+
+            # Each handler's values should only be passed through once it requests a change...
+            yield handler.new_address.eq(0x10 + index)
+            yield handler.new_config.eq(0x20 + index)
+            yield
+            self.assertEqual((yield shared.new_address), 0)
+            self.assertEqual((yield shared.new_config),  0)
+
+            # ... at which point they should appear on our shared interface.
+            yield handler.address_changed.eq(1)
+            yield handler.config_changed.eq(1)
+            yield
+            self.assertEqual((yield shared.address_changed), 1)
+            self.assertEqual((yield shared.new_address),     0x10 + index)
+            self.assertEqual((yield shared.config_changed),  1)
+            self.assertEqual((yield shared.new_config),      0x20 + index)
+
+            yield handler.address_changed.eq(0)
+            yield handler.config_changed.eq(0)
+            yield
+            self.assertEqual((yield shared.address_changed), 0)
+            self.assertEqual((yield shared.config_changed),  0)
+
+
+    @usb_domain_test_case
+    def test_transmit(self):
+        shared = self.mux.shared
+
+        # With nothing being sent, our shared transmitter should be idle.
+        yield
+        self.assertEqual((yield shared.tx.valid), 0)
+
+        yield shared.tx.ready.eq(1)
+
+        for index, handler in enumerate(self.handlers):
+            for data_pid in (0, 1):
+
+                # Each handler's data and data PID should be passed through while it's transmitting...
+                yield handler.tx.valid.eq(1)
+                yield handler.tx.first.eq(1)
+                yield handler.tx.payload.eq(0x30 + index)
+                yield handler.tx_data_pid.eq(data_pid)
+                yield
+                self.assertEqual((yield shared.tx.valid),    1)
+                self.assertEqual((yield shared.tx.first),    1)
+                self.assertEqual((yield shared.tx.payload),  0x30 + index)
+                self.assertEqual((yield shared.tx_data_pid), data_pid)
+
+                # ... and our transmitter's ready signal should be passed back to it.
+                self.assertEqual((yield handler.tx.ready), 1)
+
+                yield handler.tx.valid.eq(0)
+                yield handler.tx.first.eq(0)
+                yield
+                self.assertEqual((yield shared.tx.valid), 0)
+                self.assertEqual((yield shared.tx.first), 0)
+
+
+class USBRequestHandlerMultiplexerSingleHandlerTest(USBRequestHandlerMultiplexerTest):
+    HANDLER_COUNT = 1
+
+
+class USBRequestHandlerMultiplexerNoHandlerTest(USBRequestHandlerMultiplexerTest):
+    HANDLER_COUNT = 0
+
+
 class StallOnlyRequestHandler(Elaboratable):
     """ Simple gateware request handler that only conditionally stalls requests.
 
@@ -530,13 +768,18 @@ class StallOnlyRequestHandler(Elaboratable):
                                an Amaranth conditional indicating whether we should stall.
         """
 
-        self.condition = stall_condition
-
         #
         # I/O port
         #
         self.interface = RequestHandlerInterface()
 
+        #
+        # Internals
+        #
+
+        # Our stall condition only depends on our setup packet; so we can build it once, here.
+        self._stall_condition = stall_condition(self.interface.setup)
+
 
     def elaborate(self, platform):
         m = Module()
@@ -545,7 +788,7 @@ class StallOnlyRequestHandler(Elaboratable):
         with m.If(self.interface.data_requested | self.interface.status_requested):
 
             # ... and our stall condition is met ...
-            with m.If(self.condition(self.interface.setup)):
+            with m.If(self._stall_condition):
 
                 # ... do so.
                 m.d.comb += self.interface.handshakes_out.stall.eq(1)